@@ -0,0 +1,155 @@
+"""Process-wide cache of loaded YOLO models.
+
+Importing torch/ultralytics and deserializing weights costs seconds per load, so
+the API keeps one instance per model configuration alive for the lifetime of the process.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+# Fix for PyTorch 2.6+ compatibility with ultralytics
+# PyTorch 2.6 changed torch.load default to weights_only=True for security
+# We need to patch torch.load before ultralytics imports it
+_original_torch_load = torch.load
+
+
+def _patched_torch_load(*args, **kwargs):
+    """Patched torch.load that sets weights_only=False by default for ultralytics compatibility."""
+    # If weights_only is not explicitly set, default to False for backward compatibility
+    # This is safe since we're loading trusted YOLO model weights from ultralytics
+    if 'weights_only' not in kwargs:
+        kwargs['weights_only'] = False
+    return _original_torch_load(*args, **kwargs)
+
+
+# Patch torch.load before importing ultralytics
+torch.load = _patched_torch_load
+
+from ultralytics import YOLO
+
+# Let FP32 matmuls/convs use TF32 tensor cores on Ampere+ (no-op elsewhere).
+torch.set_float32_matmul_precision("high")
+
+# Key: (model name/path, device, half)  →  Value: loaded model
+_models: Dict[Tuple[str, str, bool], YOLO] = {}
+# One lock per model: tracking state lives on the model, so runs must not interleave.
+_model_locks: Dict[Tuple[str, str, bool], threading.Lock] = {}
+_registry_lock = threading.Lock()
+# Exports take minutes; a separate lock keeps them from blocking cached model lookups.
+_export_lock = threading.Lock()
+
+# Only PyTorch checkpoints can be moved with .to(); exported formats (TensorRT .engine,
+# ONNX, ...) pick their device/precision at export time and are loaded as-is.
+_PYTORCH_SUFFIXES = (".pt", ".yaml", ".yml")
+
+
+def cuda_available() -> bool:
+    return bool(getattr(torch, "cuda", None) is not None and torch.cuda.is_available())
+
+
+def resolve_device(device: Optional[str] = None) -> str:
+    """Normalize a device request ("auto", "cpu", "0", "cuda:1", ...), falling back to CPU without CUDA."""
+    device = (device or "auto").strip().lower()
+    if device == "auto":
+        return "cuda:0" if cuda_available() else "cpu"
+    if device == "cpu" or not cuda_available():
+        return "cpu"
+    if device.isdigit():
+        return f"cuda:{device}"
+    return device
+
+
+def resolve_half(half: bool, device: str) -> bool:
+    """FP16 only pays off on CUDA GPUs with tensor cores (compute capability 7.0+, i.e. Volta and newer).
+
+    Pascal and older run FP16 no faster than FP32, so they stay on FP32.
+    """
+    if not half or device == "cpu":
+        return False
+    try:
+        major, _minor = torch.cuda.get_device_capability(device)
+    except (AssertionError, RuntimeError, ValueError):
+        return False
+    return major >= 7
+
+
+def get_model(name: str, device: str = "cpu", half: bool = False) -> YOLO:
+    """Return the cached YOLO model for (`name`, `device`, `half`), loading it on first use.
+
+    Ultralytics fixes device and precision when the predictor is first built, so each
+    combination gets its own instance. `device` should come from `resolve_device`.
+    `name` may also point at an exported model (e.g. yolov8n.engine, yolov8n.onnx); see README.
+    """
+    key = (name, device, bool(half))
+    with _registry_lock:
+        model = _models.get(key)
+        if model is None:
+            model = YOLO(name, task="detect")
+            if is_pytorch_model(name):
+                model.to(device)
+            _models[key] = model
+        return model
+
+
+def is_pytorch_model(name: str) -> bool:
+    return name.lower().endswith(_PYTORCH_SUFFIXES)
+
+
+def export_tensorrt(name: str, device: str, half: bool = True, batch: int = 1, imgsz: int = 640) -> str:
+    """Return the path of a TensorRT engine for PyTorch checkpoint `name`, exporting it on first use.
+
+    Engines are written next to the checkpoint as e.g. `yolov8n-fp16-b8.engine` and reused
+    afterwards. They are exported with a dynamic batch (up to `batch`) and dynamic input size (up to
+    `imgsz`), so a short final batch or a smaller inference size still runs on them.
+    Raises ValueError if `name` is not a PyTorch checkpoint or `device` is not CUDA.
+    """
+    if not is_pytorch_model(name):
+        raise ValueError(f"TensorRT export needs a .pt model, got: {name}")
+    if device == "cpu":
+        raise ValueError("TensorRT export requires a CUDA device")
+    batch = max(1, int(batch))
+    source = Path(name)
+    engine = source.with_name(f"{source.stem}-{'fp16' if half else 'fp32'}-b{batch}.engine")
+    with _export_lock:
+        if not engine.exists():
+            exported = YOLO(name, task="detect").export(
+                format="engine",
+                half=bool(half),
+                simplify=True,
+                dynamic=True,
+                batch=batch,
+                imgsz=imgsz,
+                device=device,
+                verbose=False,
+            )
+            os.replace(exported, engine)
+    return str(engine)
+
+
+def get_model_lock(name: str, device: str = "cpu", half: bool = False) -> threading.Lock:
+    """Return the lock that serializes inference runs on the matching cached model."""
+    key = (name, device, bool(half))
+    with _registry_lock:
+        lock = _model_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _model_locks[key] = lock
+        return lock
+
+
+def warm_up(name: str, device: Optional[str] = None, half: bool = True, imgsz: int = 640) -> YOLO:
+    """Load `name` and run one dummy inference so CUDA context init, cuDNN autotuning and
+    kernel compilation happen before the first real request instead of during it.
+    """
+    device = resolve_device(device)
+    half = resolve_half(half, device)
+    with get_model_lock(name, device, half):
+        model = get_model(name, device, half)
+        model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), device=device, half=half, verbose=False)
+    return model
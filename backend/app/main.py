@@ -1,13 +1,13 @@
 from __future__ import annotations
 
-import json
+import logging
 import os
-import subprocess
-import sys
+import threading
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 
+import orjson
 from dotenv import load_dotenv
 
 # Load .env before anything else so env vars are available for sub-modules
@@ -15,17 +15,24 @@ _env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=_env_path)
 
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
 from .auth import get_optional_user_id
 from .database import get_database
+from .inference import warm_up
 from .routers.auth_router import router as auth_router
 from .routers.history_router import router as history_router
 from .routers.profile_router import router as profile_router
+from .video_paths import inspect_video_path, strip_quotes
+from ..scripts.count_video import InvalidOptionsError, run_count
 
-app = FastAPI(title="Vehicle Analytics API")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Vehicle Analytics API", default_response_class=ORJSONResponse)
 
 # ─── CORS ────────────────────────────────────────────────────────────────────
 app.add_middleware(
@@ -47,6 +54,23 @@ app.include_router(history_router)
 app.include_router(profile_router)
 
 
+# ─── Model warm-up ───────────────────────────────────────────────────────────
+# Comma-separated models to load + prime before serving traffic. Off by default: it loads (or
+# downloads) each model and runs a dummy inference on every start, including --reload restarts.
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "").split(",") if m.strip()]
+
+
+@app.on_event("startup")
+async def warm_up_models() -> None:
+    for name in WARMUP_MODELS:
+        try:
+            await run_in_threadpool(warm_up, name)
+        except Exception:
+            # A missing/broken model should not stop the API, but say so now rather than on
+            # the first request.
+            logger.exception("Warm-up failed for model %r", name)
+
+
 # ─── Health ──────────────────────────────────────────────────────────────────
 @app.get("/health")
 def health() -> dict:
@@ -65,35 +89,33 @@ class VideoProcessRequest(BaseModel):
     scale: Optional[float] = 0.75
     roi_band: Optional[float] = 0.0
     skip_video: Optional[bool] = False
+    batch_size: Optional[int] = 1
+    device: Optional[str] = "auto"
+    half: Optional[bool] = True
+    hwaccel: Optional[str] = "auto"
+    use_trt: Optional[bool] = False
+    encoder: Optional[str] = "auto"
 
 
 # ─── Check video path ────────────────────────────────────────────────────────
 @app.post("/api/check-video-path")
-def check_video_path(request: VideoProcessRequest) -> dict:
+async def check_video_path(request: VideoProcessRequest) -> dict:
     """Check if a video file exists at the given path (for debugging)."""
-    video_path_str = request.video_path.strip()
-    if video_path_str.startswith('"') and video_path_str.endswith('"'):
-        video_path_str = video_path_str[1:-1]
-    if video_path_str.startswith("'") and video_path_str.endswith("'"):
-        video_path_str = video_path_str[1:-1]
+    info = await run_in_threadpool(inspect_video_path, strip_quotes(request.video_path))
+    return {**info, "original_path": request.video_path}
 
-    video_path = Path(video_path_str)
-    try:
-        video_path = video_path.resolve()
-    except (OSError, ValueError) as e:
-        return {"exists": False, "error": str(e), "resolved_path": None, "original_path": request.video_path}
 
-    exists = video_path.exists()
-    is_file = video_path.is_file() if exists else False
-    return {
-        "exists": exists,
-        "is_file": is_file,
-        "resolved_path": str(video_path.absolute()),
-        "original_path": request.video_path,
-    }
+# ─── Process video (with optional auth to save history) ─────────────────────
+# Every run writes the same backend/output files (counts.json, events.ndjson, annotated.mp4)
+# that the dashboard reads, so runs are serialized process-wide, not just per model.
+_run_lock = threading.Lock()
+
+
+def _run_count_exclusive(*args, **kwargs) -> dict:
+    with _run_lock:
+        return run_count(*args, **kwargs)
 
 
-# ─── Process video (with optional auth to save history) ─────────────────────
 @app.post("/api/process-video")
 async def process_video(
     request: VideoProcessRequest,
@@ -102,113 +124,112 @@ async def process_video(
     """Process a video file and generate analytics.
     If user is authenticated, the result is automatically saved to their history.
     """
-    video_path_str = request.video_path.strip()
-    if video_path_str.startswith('"') and video_path_str.endswith('"'):
-        video_path_str = video_path_str[1:-1]
-    if video_path_str.startswith("'") and video_path_str.endswith("'"):
-        video_path_str = video_path_str[1:-1]
-
-    video_path = Path(video_path_str)
-    try:
-        video_path = video_path.resolve()
-    except (OSError, ValueError) as e:
-        raise HTTPException(status_code=400, detail=f"Invalid video path: {video_path_str}. Error: {str(e)}")
-
-    if not video_path.exists():
+    video_path_str = strip_quotes(request.video_path)
+    info = await run_in_threadpool(inspect_video_path, video_path_str)
+    if "error" in info:
+        raise HTTPException(status_code=400, detail=f"Invalid video path: {video_path_str}. Error: {info['error']}")
+    if not info["exists"]:
         raise HTTPException(
             status_code=404,
-            detail=f"Video file not found at: {str(video_path.absolute())}. Please check if the file exists.",
+            detail=f"Video file not found at: {info['resolved_path']}. Please check if the file exists.",
         )
-    if not video_path.is_file():
+    video_path = Path(info["resolved_path"])
+    if not info["is_file"]:
         raise HTTPException(status_code=400, detail=f"Path is not a file: {video_path}")
 
     current_file = Path(__file__).resolve()
     project_root = current_file.parent.parent.parent
-    script_path = project_root / "backend" / "scripts" / "count_video.py"
-
-    if not script_path.exists():
-        raise HTTPException(status_code=500, detail=f"count_video.py script not found at {script_path}")
-
-    cmd = [
-        sys.executable, str(script_path),
-        "--video", str(video_path.resolve()),
-        "--model", request.model,
-        "--line-y", str(request.line_y),
-        "--conf", str(request.conf),
-        "--anchor", str(request.anchor or "bottom"),
-        "--frame-stride", str(int(request.frame_stride or 1)),
-        "--scale", str(float(request.scale or 1.0)),
-        "--roi-band", str(float(request.roi_band or 0.0)),
-    ]
-    if request.skip_video:
-        cmd.append("--skip-video")
-    if request.invert_directions:
-        cmd.append("--invert-directions")
+    output_root = project_root / "backend" / "output"
 
     try:
-        env = os.environ.copy()
-        env["PYTHONPATH"] = str(project_root)
-
-        result = subprocess.run(
-            cmd, capture_output=True, text=True,
-            cwd=str(project_root), env=env, timeout=3600,
+        # Runs in-process against the cached model; the thread pool keeps the event loop free.
+        analytics_data = await run_in_threadpool(
+            _run_count_exclusive,
+            video_path,
+            model=request.model,
+            line_y=float(request.line_y),
+            invert_directions=bool(request.invert_directions),
+            conf=float(request.conf),
+            anchor=str(request.anchor or "bottom"),
+            frame_stride=int(request.frame_stride or 1),
+            scale=float(request.scale or 1.0),
+            roi_band=float(request.roi_band or 0.0),
+            skip_video=bool(request.skip_video),
+            batch_size=int(request.batch_size or 1),
+            device=str(request.device or "auto"),
+            half=bool(request.half),
+            hwaccel=str(request.hwaccel or "auto"),
+            use_trt=bool(request.use_trt),
+            encoder=str(request.encoder or "auto"),
+            save_json=output_root / "counts.json",
+            output_video=output_root / "annotated.mp4",
         )
-        if result.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Video processing failed: {result.stderr}")
-
-        analytics_path = project_root / "backend" / "output" / "counts.json"
-        if not analytics_path.exists():
-            raise HTTPException(status_code=500, detail="Analytics file was not generated")
-
-        analytics_data = json.loads(analytics_path.read_text(encoding="utf-8"))
-
-        # ── Save to history if authenticated ──────────────────────────────
-        if user_id:
-            try:
-                counts = analytics_data.get("counts", {})
-                total_vehicles = counts.get("total", 0)
-                db = get_database()
-                history_col = db["analytics_history"]
-                record = {
-                    "user_id": user_id,
-                    "video_path": str(video_path),
-                    "model": request.model,
-                    "processed_at": datetime.utcnow(),
-                    "total_vehicles": total_vehicles,
-                    "counts": counts,
-                    "video_info": {
-                        "line_y": request.line_y,
-                        "conf": request.conf,
-                        "anchor": request.anchor,
-                        "invert_directions": request.invert_directions,
-                    },
-                }
-                await history_col.insert_one(record)
-            except Exception:
-                # Don't fail the request if history save fails
-                pass
-
-        return analytics_data
-
-    except subprocess.TimeoutExpired:
-        raise HTTPException(status_code=504, detail="Video processing timed out")
-    except HTTPException:
-        raise
+    except InvalidOptionsError as e:
+        # Invalid options (scale, roi_band, encoder, ...) are the caller's mistake.
+        raise HTTPException(status_code=400, detail=f"Invalid processing options: {e}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=f"Video processing failed: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing video: {str(e)}")
 
+    # ── Save to history if authenticated ──────────────────────────────
+    if user_id:
+        try:
+            counts = analytics_data.get("counts", {})
+            total_vehicles = counts.get("total", 0)
+            db = get_database()
+            history_col = db["analytics_history"]
+            record = {
+                "user_id": user_id,
+                "video_path": str(video_path),
+                "model": request.model,
+                "processed_at": datetime.utcnow(),
+                "total_vehicles": total_vehicles,
+                "counts": counts,
+                "video_info": {
+                    "line_y": request.line_y,
+                    "conf": request.conf,
+                    "anchor": request.anchor,
+                    "invert_directions": request.invert_directions,
+                },
+            }
+            await history_col.insert_one(record)
+        except Exception:
+            # Don't fail the request if history save fails
+            pass
+
+    return analytics_data
+
 
 # ─── Latest analytics ────────────────────────────────────────────────────────
+# Last parsed counts.json as ((st_mtime_ns, st_size), data); dashboard polling then
+# skips the read + decode until the file is rewritten.
+_analytics_cache: Optional[Tuple[Tuple[int, int], dict]] = None
+
+
+def _load_analytics(path: Path) -> dict:
+    """Parsed counts.json; raises FileNotFoundError if no run has written it yet."""
+    global _analytics_cache
+    st = path.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _analytics_cache
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    data = orjson.loads(path.read_bytes())
+    _analytics_cache = (key, data)
+    return data
+
+
 @app.get("/api/analytics")
-def get_analytics() -> dict:
+async def get_analytics() -> dict:
     """Returns the latest analytics JSON generated by count_video script."""
     current_file = Path(__file__).resolve()
     project_root = current_file.parent.parent.parent
     path = project_root / "backend" / "output" / "counts.json"
 
-    if not path.exists():
-        raise HTTPException(status_code=404, detail="counts.json not found. Run the counting script first.")
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except json.JSONDecodeError as e:
+        return await run_in_threadpool(_load_analytics, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="counts.json not found. Run the counting script first.")
+    except orjson.JSONDecodeError as e:
         raise HTTPException(status_code=500, detail=f"Invalid JSON in counts.json: {e}")
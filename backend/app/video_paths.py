@@ -0,0 +1,32 @@
+"""Validation of user-supplied video paths for the processing endpoints.
+Kept free of FastAPI/model imports so it can be used (and tested) on its own.
+"""
+from __future__ import annotations
+
+import os
+import stat
+
+
+def strip_quotes(raw: str) -> str:
+    """Trim whitespace and one pair of surrounding quotes (as pasted from a file manager)."""
+    video_path_str = raw.strip()
+    if video_path_str.startswith('"') and video_path_str.endswith('"'):
+        video_path_str = video_path_str[1:-1]
+    if video_path_str.startswith("'") and video_path_str.endswith("'"):
+        video_path_str = video_path_str[1:-1]
+    return video_path_str
+
+
+def inspect_video_path(video_path_str: str) -> dict:
+    """Resolve `video_path_str` and derive exists/is_file from a single stat() call.
+
+    Unusable paths (e.g. an embedded NUL byte) come back with an "error" entry instead of raising.
+    """
+    try:
+        resolved = os.path.realpath(video_path_str)
+        st = os.stat(resolved)
+    except (FileNotFoundError, NotADirectoryError):
+        return {"exists": False, "is_file": False, "resolved_path": resolved}
+    except (OSError, ValueError) as e:
+        return {"exists": False, "is_file": False, "resolved_path": None, "error": str(e)}
+    return {"exists": True, "is_file": stat.S_ISREG(st.st_mode), "resolved_path": resolved}
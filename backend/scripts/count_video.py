@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import argparse
-import json
+import os
+import queue
 import sys
+import threading
 from datetime import datetime, timezone
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
 
 # If invoked as a script (python backend/scripts/count_video.py), ensure project root is on sys.path
 # so imports like `from backend...` work. When invoked with `python -m backend.scripts.count_video`,
@@ -15,32 +18,35 @@ if str(_project_root) not in sys.path:
     sys.path.insert(0, str(_project_root))
 
 import cv2
-import torch
-
-# Fix for PyTorch 2.6+ compatibility with ultralytics
-# PyTorch 2.6 changed torch.load default to weights_only=True for security
-# We need to patch torch.load before ultralytics imports it
-_original_torch_load = torch.load
-
-def _patched_torch_load(*args, **kwargs):
-    """Patched torch.load that sets weights_only=False by default for ultralytics compatibility."""
-    # If weights_only is not explicitly set, default to False for backward compatibility
-    # This is safe since we're loading trusted YOLO model weights from ultralytics
-    if 'weights_only' not in kwargs:
-        kwargs['weights_only'] = False
-    return _original_torch_load(*args, **kwargs)
-
-# Patch torch.load before importing ultralytics
-torch.load = _patched_torch_load
-
-from ultralytics import YOLO
-
+import numpy as np
+import orjson
+
+from backend.app.inference import (
+    export_tensorrt,
+    get_model,
+    get_model_lock,
+    is_pytorch_model,
+    resolve_device,
+    resolve_half,
+)
 from backend.vehicle_counting.line_counter import (
-    COCO_CLASS_TO_CATEGORY,
+    CATEGORY_BY_COCO_ID,
+    VEHICLE_COCO_IDS,
+    Counts,
     Line,
     LineCrossingCounter,
-    TrackObservation,
+    categorize_ids,
+    category_ids_for_names,
 )
+from backend.vehicle_counting.video_io import (
+    ENCODER_CHOICES,
+    HWACCEL_CHOICES,
+    open_video_reader,
+    open_video_writer,
+)
+
+DEFAULT_SAVE_JSON = Path("backend") / "output" / "counts.json"
+DEFAULT_OUTPUT_VIDEO = Path("backend") / "output" / "annotated.mp4"
 
 
 def _parse_args() -> argparse.Namespace:
@@ -80,13 +86,54 @@ def _parse_args() -> argparse.Namespace:
         "--scale",
         type=float,
         default=1.0,
-        help="Downscale factor for processing (e.g. 0.75). Speeds up YOLO tracking.",
+        help=(
+            "Downscale factor for YOLO input (e.g. 0.75); the input is also capped at 640px on the long "
+            "side and aligned to 32px. Speeds up tracking; output stays full resolution."
+        ),
     )
     p.add_argument(
         "--roi-band",
         type=float,
         default=0.0,
-        help="Optional vertical band (fraction of frame height) around the line to track/count within (0 = disabled).",
+        help=(
+            "Optional vertical band (fraction of frame height) around the line to track/count within "
+            "(0 = disabled). YOLO then only runs on a strip around the line."
+        ),
+    )
+    p.add_argument(
+        "--batch-size",
+        "--batch",
+        type=int,
+        default=1,
+        help="Number of frames sent to YOLO per call (higher improves GPU utilization).",
+    )
+    p.add_argument(
+        "--device",
+        default="auto",
+        help="Inference device: auto, cpu, 0, cuda:1, ... (falls back to cpu without CUDA).",
+    )
+    p.add_argument(
+        "--half",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Use FP16 inference on CUDA devices (ignored on cpu).",
+    )
+    p.add_argument(
+        "--use-trt",
+        action="store_true",
+        help="Export a .pt model to a TensorRT engine (once, cached next to it) and run that instead.",
+    )
+    p.add_argument(
+        "--hwaccel",
+        choices=HWACCEL_CHOICES,
+        default="auto",
+        help="Video decode: auto (fastest available), none (software), cuda or vaapi.",
+    )
+    p.add_argument(
+        "--encoder",
+        choices=list(ENCODER_CHOICES),
+        default="auto",
+        help="Annotated video encoder: auto (best H.264 available), nvenc, libx264 or mp4v (OpenCV).",
     )
     p.add_argument(
         "--skip-video",
@@ -101,12 +148,12 @@ def _parse_args() -> argparse.Namespace:
     )
     p.add_argument(
         "--save-json",
-        default=str(Path("backend") / "output" / "counts.json"),
+        default=str(DEFAULT_SAVE_JSON),
         help="Where to write output JSON.",
     )
     p.add_argument(
         "--output-video",
-        default=str(Path("backend") / "output" / "annotated.mp4"),
+        default=str(DEFAULT_OUTPUT_VIDEO),
         help="Where to write the annotated output video.",
     )
     p.add_argument(
@@ -127,250 +174,768 @@ def _ensure_parent_dir(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
 
-def _anchor_xyxy(xyxy, *, anchor: str) -> tuple[float, float]:
-    x1, y1, x2, y2 = [float(v) for v in xyxy]
-    cx = (x1 + x2) / 2.0
+# Bounded queues between the decode / inference / encode threads (back-pressure).
+_PREFETCH_FRAMES = 8
+# End-of-stream sentinel passed through the frame queues.
+_EOF = None
+# Partial counts.json snapshots are written at most this often while processing.
+_SNAPSHOT_EVERY_FRAMES = 300
+# Crossing ledger written next to the counts JSON.
+EVENTS_FILENAME = "events.ndjson"
+
+
+def _put_unless_stopped(q: queue.Queue, item, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _read_frames(
+    cap,
+    read_q: queue.Queue,
+    stop: threading.Event,
+    stride: int = 1,
+    prepare: Optional[Callable] = None,
+    errors: Optional[list] = None,
+) -> None:
+    """Reader thread: decode every `stride`-th frame until EOF (or `stop`), then send `_EOF`.
+
+    Puts `(frame, prepare(frame))` so the model-input crop/resize also happens off the main
+    thread. The frames in between are only grabbed, which skips the BGR conversion/copy.
+    A decode/prepare failure is appended to `errors` before `_EOF` is sent, so the consumer
+    can tell it apart from the end of the video.
+    """
+    try:
+        while not stop.is_set():
+            if not all(cap.grab() for _ in range(stride - 1)):
+                break
+            ok, frame = cap.read()
+            if not ok:
+                break
+            _put_unless_stopped(read_q, (frame, prepare(frame) if prepare else frame), stop)
+    except Exception as e:
+        if errors is None:
+            raise
+        errors.append(e)
+    finally:
+        _put_unless_stopped(read_q, _EOF, stop)
+
+
+def _write_frames(writer, write_q: queue.Queue, errors: list) -> None:
+    """Writer thread: encode frames from `write_q` until `_EOF`.
+
+    Keeps draining after a failure so the producer never blocks on a full queue.
+    """
+    while True:
+        frame = write_q.get()
+        if frame is _EOF:
+            return
+        if errors:
+            continue
+        try:
+            writer.write(frame)
+        except Exception as e:
+            errors.append(e)
+
+
+def _anchor_points(xyxy: np.ndarray, *, anchor: str) -> np.ndarray:
+    """(N, 4) boxes -> (N, 2) anchor points used for line crossing."""
+    cx = (xyxy[:, 0] + xyxy[:, 2]) * 0.5
     if anchor == "bottom":
-        return (cx, y2)
+        return np.column_stack((cx, xyxy[:, 3]))
     # default: center
-    return (cx, (y1 + y2) / 2.0)
+    return np.column_stack((cx, (xyxy[:, 1] + xyxy[:, 3]) * 0.5))
+
+
+# Ultralytics' default inference size (long side) and the YOLO stride grid.
+_MAX_IMGSZ = 640
+_STRIDE = 32
+
+
+def _align_to_stride(size: float) -> int:
+    return max(_STRIDE, int(round(size / _STRIDE)) * _STRIDE)
+
+
+def _inference_size(width: int, height: int, scale: float) -> Tuple[int, int]:
+    """(width, height) YOLO sees for a `width` x `height` input: scaled, capped at `_MAX_IMGSZ`
+    on the long side and aligned to the stride grid."""
+    fit = min(float(scale), _MAX_IMGSZ / max(width, height))
+    return _align_to_stride(width * fit), _align_to_stride(height * fit)
+
+
+_NO_CATEGORIES = np.empty(0, dtype=np.int8)
+_NO_OBSERVATIONS = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), _NO_CATEGORIES)
+
+
+class _CudaResizer:
+    """INTER_AREA resize on the GPU via cv2.cuda, reusing the device buffers between frames.
+
+    Not thread-safe: each instance is only used from the reader thread.
+    """
+
+    def __init__(self):
+        self._src = cv2.cuda_GpuMat()
+        self._dst = cv2.cuda_GpuMat()
+
+    def __call__(self, frame, size: Tuple[int, int], interpolation: int = cv2.INTER_AREA):
+        self._src.upload(frame)
+        self._dst = cv2.cuda.resize(self._src, size, self._dst, interpolation=interpolation)
+        return self._dst.download()
+
+
+def _cuda_resize_available() -> bool:
+    try:
+        return hasattr(cv2, "cuda_GpuMat") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+
+def _inference_input(
+    frame,
+    *,
+    crop_y0: int,
+    crop_y1: int,
+    proc_size: Tuple[int, int],
+    resize: Callable = cv2.resize,
+):
+    """Crop `frame` to the ROI rows and resize it to `proc_size` (no-ops are skipped)."""
+    if crop_y0 != 0 or crop_y1 != frame.shape[0]:
+        frame = frame[crop_y0:crop_y1]
+    if (frame.shape[1], frame.shape[0]) != proc_size:
+        frame = resize(frame, proc_size, interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def _extract_observations(
+    r,
+    *,
+    anchor: str,
+    roi_band: float,
+    frame_height: int,
+    line_y_px: float,
+    category_table: np.ndarray,
+    inv_scale: Tuple[float, float] = (1.0, 1.0),
+    y_offset: float = 0.0,
+    collect_drawn: bool = True,
+) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], List[Tuple[list, str]], int, int]:
+    """Turn one tracking result into counter input for `LineCrossingCounter.update_batch`.
+
+    `category_table` comes from `category_ids_for_names(model names)` (computed once per run).
+    Boxes are mapped back to full-resolution coordinates with `inv_scale` (x, y factors)
+    and `y_offset` (top of the ROI crop the model saw).
+    Returns ((track ids, anchor ys, category ids), boxes to draw as (xyxy, label), raw detections,
+    vehicle detections); the boxes list stays empty when `collect_drawn` is False (nothing is rendered).
+    """
+    names: Dict[int, str] = getattr(r, "names", {})
+    boxes = getattr(r, "boxes", None)
+
+    drawn: List[Tuple[list, str]] = []
+
+    # Only tracked objects have IDs
+    if boxes is None or boxes.id is None:
+        return _NO_OBSERVATIONS, drawn, 0, 0
+
+    # Pull each tensor to the host once and filter with array ops; the counter consumes the
+    # surviving rows as arrays, and only drawn boxes become Python objects.
+    # Tracked boxes.data is (N, 7): x1, y1, x2, y2, track id, conf, cls. One device->host copy
+    # (and sync) for all columns instead of one per attribute.
+    data = boxes.data.cpu().numpy()
+    xyxy = data[:, :4]
+    if inv_scale != (1.0, 1.0):
+        sx, sy = inv_scale
+        xyxy = xyxy * np.array([sx, sy, sx, sy], dtype=xyxy.dtype)
+    if y_offset:
+        xyxy = xyxy + np.array([0.0, y_offset, 0.0, y_offset], dtype=xyxy.dtype)
+    cls = data[:, -1].astype(np.int32)
+    track_ids = data[:, -3].astype(np.int64)
+
+    category_ids = categorize_ids(cls, category_table)
+    is_vehicle = category_ids >= 0
+    anchors = _anchor_points(xyxy, anchor=anchor)
+
+    keep = is_vehicle
+    # Optional ROI band
+    if float(roi_band) > 0.0:
+        half_band = float(frame_height) * float(roi_band) / 2.0
+        ay = anchors[:, 1]
+        keep = keep & (ay >= line_y_px - half_band) & (ay <= line_y_px + half_band)
+
+    observations = (track_ids[keep], anchors[keep, 1], category_ids[keep])
+    if collect_drawn:
+        for box, cls_id, track_id in zip(
+            xyxy[keep].tolist(), cls[keep].tolist(), observations[0].tolist()
+        ):
+            drawn.append((box, f"{names[cls_id]} #{track_id}"))
+
+    return observations, drawn, int(xyxy.shape[0]), int(np.count_nonzero(is_vehicle))
+
+
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+@lru_cache(maxsize=1024)
+def _text_stamp(text: str, scale: float) -> Tuple[np.ndarray, np.ndarray, int, int]:
+    """Render `text` once as white fill with a black outline.
+
+    Returns (pixels, mask, dx, dy); (dx, dy) is the putText baseline origin inside the patch.
+    Labels repeat for as long as a track is visible, so most are blitted from this cache.
+    """
+    (w, h), baseline = cv2.getTextSize(text, _FONT, scale, 3)
+    pad = 2
+    dx, dy = pad, h + pad
+    shape = (h + baseline + 2 * pad, w + 2 * pad)
+    mask = np.zeros(shape, dtype=np.uint8)
+    cv2.putText(mask, text, (dx, dy), _FONT, scale, 255, 3)
+    # Black outline = the zero background under the mask; only the fill needs drawing.
+    pixels = np.zeros(shape + (3,), dtype=np.uint8)
+    cv2.putText(pixels, text, (dx, dy), _FONT, scale, (255, 255, 255), 1)
+    return pixels, mask.astype(bool)[:, :, None], dx, dy
+
+
+def _put_text(frame, text: str, org: Tuple[int, int], scale: float) -> None:
+    """Blit the cached stamp for `text` with its baseline origin at `org`, clipped to the frame."""
+    pixels, mask, dx, dy = _text_stamp(text, scale)
+    x0, y0 = org[0] - dx, org[1] - dy
+    ph, pw = mask.shape[:2]
+    fh, fw = frame.shape[:2]
+    cx0, cy0 = max(0, x0), max(0, y0)
+    cx1, cy1 = min(fw, x0 + pw), min(fh, y0 + ph)
+    if cx0 >= cx1 or cy0 >= cy1:
+        return
+    np.copyto(
+        frame[cy0:cy1, cx0:cx1],
+        pixels[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0],
+        where=mask[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0],
+    )
 
 
-def main() -> int:
-    args = _parse_args()
-    video_path = Path(args.video)
-    if not video_path.exists():
-        raise SystemExit(f"Video not found: {video_path}")
+def _draw_detections(frame, drawn: List[Tuple[list, str]]) -> None:
+    """Draw bbox + label for each counted detection."""
+    for xyxy, label in drawn:
+        x1, y1, x2, y2 = [int(v) for v in xyxy]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 200, 0), 2)
+        _put_text(frame, label, (x1, max(20, y1 - 7)), 0.6)
+
+
+class _LineOverlay:
+    """Counting line rendered once; per frame only the few rows it touches are copied in."""
+
+    def __init__(self, width: int, height: int, line_y_px: float):
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        cv2.line(
+            canvas,
+            (0, int(line_y_px)),
+            (width, int(line_y_px)),
+            (0, 255, 255),
+            2,
+        )
+        mask = canvas.any(axis=2)
+        rows = np.flatnonzero(mask.any(axis=1))
+        self._y0, self._y1 = (int(rows[0]), int(rows[-1]) + 1) if rows.size else (0, 0)
+        self._pixels = canvas[self._y0:self._y1].copy()
+        self._mask = mask[self._y0:self._y1, :, None].copy()
+
+    def apply(self, frame) -> None:
+        np.copyto(frame[self._y0:self._y1], self._pixels, where=self._mask)
+
+
+class _Hud:
+    """Counting line plus running totals; the text is only rebuilt when the counts change."""
+
+    def __init__(self, line_overlay: _LineOverlay):
+        self._line_overlay = line_overlay
+        self._matrix: Optional[np.ndarray] = None
+        self._texts: Tuple[str, str] = ("", "")
+
+    def draw(self, frame, counts: Counts) -> None:
+        self._line_overlay.apply(frame)
 
-    # Load YOLO model (torch.load is already patched at module level for PyTorch 2.6+ compatibility)
-    model = YOLO(args.model)
-    use_gpu_yolo = bool(getattr(torch, "cuda", None) is not None and torch.cuda.is_available())
+        if self._matrix is None or not np.array_equal(self._matrix, counts.matrix):
+            self._matrix = counts.matrix.copy()
+            cj = counts.to_jsonable()
+            self._texts = (
+                f"total={cj['total']} in={cj['in']['total']} out={cj['out']['total']}",
+                f"car={cj['by_category']['car']} bike={cj['by_category']['bike']} bus={cj['by_category']['bus']} "
+                f"truck={cj['by_category']['truck']}",
+            )
+        text1, text2 = self._texts
+        _put_text(frame, text1, (10, 30), 0.8)
+        _put_text(frame, text2, (10, 60), 0.8)
+
+
+def _debug_stats(frames_total: int, frames_used: int, detections_total: int, detections_vehicle: int) -> dict:
+    return {
+        "frames_total": int(frames_total),
+        "frames_used": int(frames_used),
+        "raw_detections_total": int(detections_total),
+        "vehicle_detections_total": int(detections_vehicle),
+    }
+
+
+def _build_payload(run_info: dict, counter: LineCrossingCounter, debug: dict, *, complete: bool) -> dict:
+    return {
+        **run_info,
+        "debug": debug,
+        "counts": counter.counts.to_jsonable(),
+        "counted_track_ids": counter.counted_track_ids,
+        "complete": complete,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _write_json_atomic(path: Path, payload: dict) -> None:
+    """Write via tmp file + rename so readers never see a half-written counts.json."""
+    # Unique per writer, so concurrent runs can never rename each other's tmp file away.
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, path)
 
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        raise SystemExit(f"Failed to open video: {video_path}")
 
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
-    if height <= 0:
-        raise SystemExit("Could not determine video height")
+class _EventLedger:
+    """Append-only crossing ledger (events.ndjson): one JSON line per counted vehicle.
 
-    scale = float(args.scale)
+    Written unbuffered, one write per line, so progress survives a crash. Set `frame` to the
+    source frame index before feeding that frame to the counter; events are stamped with it.
+    """
+
+    def __init__(self, path: Path):
+        self._file = open(path, "wb", buffering=0)
+        self.frame = 0
+
+    def log(self, track_id: int, category, direction) -> None:
+        self._file.write(
+            orjson.dumps(
+                {"track_id": track_id, "category": category.value, "direction": direction.value, "t": self.frame}
+            )
+            + b"\n"
+        )
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _track_kwargs(
+    model: str,
+    *,
+    conf: float,
+    classes: Optional[List[int]],
+    imgsz: Tuple[int, int],
+    device: str,
+    half: bool,
+) -> dict:
+    """Keyword arguments for `yolo.track`, the same for every batch of a run."""
+    kwargs = {
+        "persist": True,
+        "conf": float(conf),
+        "classes": classes,
+        "verbose": False,
+        "device": device,
+        "half": half,
+    }
+    # Exported models (.engine/.onnx/...) keep the input size they were exported with, and
+    # Ultralytics rejects imgsz=None, so the argument is only passed to PyTorch checkpoints.
+    if is_pytorch_model(model):
+        kwargs["imgsz"] = imgsz
+    return kwargs
+
+
+class InvalidOptionsError(ValueError):
+    """An argument passed to `run_count` is invalid (as opposed to a failure while processing)."""
+
+
+def _reset_tracking_state(model) -> None:
+    """Drop ByteTrack state persisted on a cached model by a previous video."""
+    predictor = getattr(model, "predictor", None)
+    for tracker in getattr(predictor, "trackers", None) or []:
+        tracker.reset()
+
+
+def run_count(
+    video_path: str | Path,
+    *,
+    model: str = "yolov8n.pt",
+    line_y: float = 0.5,
+    invert_directions: bool = False,
+    conf: float = 0.25,
+    frame_stride: int = 1,
+    scale: float = 1.0,
+    roi_band: float = 0.0,
+    skip_video: bool = False,
+    anchor: str = "bottom",
+    save_json: str | Path = DEFAULT_SAVE_JSON,
+    output_video: str | Path = DEFAULT_OUTPUT_VIDEO,
+    max_frames: int = 0,
+    show: bool = False,
+    batch_size: int = 1,
+    device: str = "auto",
+    half: bool = True,
+    hwaccel: str = "auto",
+    use_trt: bool = False,
+    encoder: str = "auto",
+) -> dict:
+    """Count line crossings in `video_path`, write the JSON payload to `save_json` and return it.
+
+    Raises InvalidOptionsError for invalid inputs and RuntimeError if the video cannot be read/written.
+    """
+    video_path = Path(video_path)
+    if not video_path.exists():
+        raise InvalidOptionsError(f"Video not found: {video_path}")
+    if encoder not in ENCODER_CHOICES:
+        raise InvalidOptionsError(f"encoder must be one of {', '.join(ENCODER_CHOICES)}")
+    scale = float(scale)
     if scale <= 0.0 or scale > 1.0:
-        raise SystemExit("--scale must be within (0, 1]")
-
-    proc_width = int(round(width * scale))
-    proc_height = int(round(height * scale))
-    if proc_width <= 0 or proc_height <= 0:
-        raise SystemExit("Invalid processing size after scaling")
-
-    line_y_px = float(proc_height) * float(args.line_y)
-    # A small margin around the line makes counting less sensitive to bbox jitter.
-    line_margin_px = float(max(2.0, 0.01 * float(proc_height)))
-    counter = LineCrossingCounter(
-        Line(y_px=line_y_px),
-        invert_directions=args.invert_directions,
-        line_margin_px=line_margin_px,
-    )
+        raise InvalidOptionsError("scale must be within (0, 1]")
+    hwaccel = (hwaccel or "auto").strip().lower()
+    if hwaccel not in HWACCEL_CHOICES:
+        raise InvalidOptionsError(f"hwaccel must be one of {', '.join(HWACCEL_CHOICES)}")
+
+    device = resolve_device(device)
+    if use_trt and device == "cpu":
+        raise InvalidOptionsError("use_trt requires a CUDA device")
+    half = resolve_half(half, device)
+    if use_trt and is_pytorch_model(model):
+        model = export_tensorrt(model, device, half, batch=batch_size)
+
+    # Serialize runs per model: ByteTrack state is persisted on the cached model instance.
+    with get_model_lock(model, device, half):
+        yolo = get_model(model, device, half)
+        _reset_tracking_state(yolo)
+        return _run_count(
+            yolo,
+            video_path,
+            model=model,
+            line_y=line_y,
+            invert_directions=invert_directions,
+            conf=conf,
+            frame_stride=frame_stride,
+            scale=scale,
+            roi_band=roi_band,
+            skip_video=skip_video,
+            anchor=anchor,
+            save_json=Path(save_json),
+            output_video=Path(output_video),
+            max_frames=max_frames,
+            show=show,
+            batch_size=batch_size,
+            device=device,
+            half=half,
+            hwaccel=hwaccel,
+            encoder=encoder,
+        )
 
-    out_video_path = Path(args.output_video)
-    _ensure_parent_dir(out_video_path)
 
-    fps = float(cap.get(cv2.CAP_PROP_FPS) or 0.0)
-    if fps <= 0:
-        fps = 30.0
+def _run_count(
+    yolo,
+    video_path: Path,
+    *,
+    model: str,
+    line_y: float,
+    invert_directions: bool,
+    conf: float,
+    frame_stride: int,
+    scale: float,
+    roi_band: float,
+    skip_video: bool,
+    anchor: str,
+    save_json: Path,
+    output_video: Path,
+    max_frames: int,
+    show: bool,
+    batch_size: int,
+    device: str,
+    half: bool,
+    hwaccel: str,
+    encoder: str,
+) -> dict:
+    # If showing preview, we must render frames.
+    if show:
+        skip_video = False
 
     # Tracker configuration
     # We use ByteTrack which is built-in to Ultralytics.
     tracker_config = "bytetrack.yaml"
 
-    # If showing preview, we must render frames.
-    if args.show:
-        args.skip_video = False
-
-    writer = None
-    if not args.skip_video:
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        writer = cv2.VideoWriter(str(out_video_path), fourcc, fps, (proc_width, proc_height))
-        if not writer.isOpened():
-            raise SystemExit(f"Failed to open VideoWriter for: {out_video_path}")
-
-    frame_idx = 0
-    frames_total = 0
-    frames_used = 0
-    detections_total = 0
-    detections_vehicle = 0
+    # Class names are fixed per model: build the category lookup table once. The vehicle
+    # class ids are filtered inside YOLO's NMS, so non-vehicles never reach the host or the tracker.
+    names = getattr(yolo, "names", None)
+    if names:
+        category_table = category_ids_for_names(names)
+        vehicle_classes = np.flatnonzero(category_table >= 0).tolist() or None
+    else:
+        # Some exported models carry no class names; assume the COCO ids they were trained on.
+        category_table = CATEGORY_BY_COCO_ID
+        vehicle_classes = list(VEHICLE_COCO_IDS)
+
+    out_path = save_json
+    _ensure_parent_dir(out_path)
+    out_video_path = output_video
+    _ensure_parent_dir(out_video_path)
 
-    while True:
-        ok, frame = cap.read()
-        if not ok:
-            break
-
-        frame_idx += 1
-        frames_total += 1
-        if args.max_frames and frame_idx > args.max_frames:
-            break
-
-        # Downscale for faster processing if requested.
-        if scale != 1.0:
-            frame = cv2.resize(frame, (proc_width, proc_height), interpolation=cv2.INTER_AREA)
-
-        stride = int(max(1, args.frame_stride))
-        if stride > 1 and (frame_idx % stride) != 0:
-            if writer is not None:
-                writer.write(frame)
-            continue
+    stride = int(max(1, frame_stride))
+    batch_size = int(max(1, batch_size))
 
-        frames_used += 1
+    # Decode and encode run in their own threads so they overlap with inference.
+    # Tracking/counting stay on this thread, so no locking is needed around them.
+    stop = threading.Event()
+    read_q: queue.Queue = queue.Queue(maxsize=_PREFETCH_FRAMES)
+    write_q: queue.Queue = queue.Queue(maxsize=_PREFETCH_FRAMES)
+    write_errors: list = []
+    read_errors: list = []
 
-        # Use model.track instead of predict for native tracking
-        results = model.track(
-            frame,
-            persist=True,
-            tracker=tracker_config,
-            conf=float(args.conf),
-            verbose=False,
-            device=0 if use_gpu_yolo else "cpu",
+    # Everything opened below is released in the `finally`, whichever step fails.
+    cap = None
+    writer = None
+    ledger = None
+    reader_thread = None
+    writer_thread = None
+    completed = False
+    try:
+        # NVDEC / FFmpeg hardware / multithreaded decode when available, cv2.VideoCapture otherwise.
+        cap = open_video_reader(video_path, hwaccel)
+        width = cap.width
+        height = cap.height
+        if height <= 0:
+            raise RuntimeError("Could not determine video height")
+
+        # Counting, drawing and writing happen at full resolution; only YOLO sees the scaled frame.
+        line_y_px = float(height) * float(line_y)
+
+        # With an ROI band, YOLO only sees a horizontal strip around the line. The strip is twice
+        # the counting band so vehicles whose anchor is inside the band are not cut off.
+        crop_y0, crop_y1 = 0, height
+        if float(roi_band) > 0.0:
+            crop_y0 = int(max(0.0, line_y_px - float(roi_band) * height))
+            crop_y1 = int(min(float(height), line_y_px + float(roi_band) * height))
+            if crop_y1 <= crop_y0:
+                raise InvalidOptionsError("roi_band leaves no rows to process")
+
+        # YOLO would otherwise letterbox every input to a 640 long side (upscaling small ones) and
+        # pad it to the 32px stride grid. Resizing straight to a 32-aligned size within that bound
+        # and passing it as imgsz makes our resize the only one, with no padding. Exported models
+        # keep their export size instead (see _track_kwargs).
+        crop_height = crop_y1 - crop_y0
+        proc_width, proc_height = _inference_size(width, crop_height, scale)
+        # Per-axis factors mapping boxes back to full resolution (alignment can change the aspect slightly).
+        inv_scale = (width / proc_width, crop_height / proc_height)
+        track_kwargs = _track_kwargs(
+            model,
+            conf=conf,
+            classes=vehicle_classes,
+            imgsz=(proc_height, proc_width),
+            device=device,
+            half=half,
         )
 
-        if not results:
-            writer.write(frame)
-            continue
+        # A small margin around the line makes counting less sensitive to bbox jitter.
+        line_margin_px = float(max(2.0, 0.01 * float(height)))
+
+        fps = float(cap.fps)
+        if fps <= 0:
+            fps = 30.0
+
+        # Downscale on the GPU when OpenCV was built with CUDA and inference runs there anyway.
+        needs_resize = (proc_width, proc_height) != (width, crop_height)
+        use_cuda_resize = needs_resize and device != "cpu" and _cuda_resize_available()
+        # Crop/downscale the inference input only; the original frame is kept for drawing.
+        prepare = partial(
+            _inference_input,
+            crop_y0=crop_y0,
+            crop_y1=crop_y1,
+            proc_size=(proc_width, proc_height),
+            resize=_CudaResizer() if use_cuda_resize else cv2.resize,
+        )
 
-        r = results[0]
-        names: Dict[int, str] = getattr(r, "names", {})
-        boxes = getattr(r, "boxes", None)
-
-        observations: List[TrackObservation] = []
-
-        if boxes is not None:
-            # Check if we have IDs (only tracked objects have IDs)
-            if boxes.id is not None:
-                detections_total += int(len(boxes))
-                
-                # Get boxes, classes, confidences, and track IDs
-                # boxes.xyxy is (N, 4), boxes.conf is (N,), boxes.cls is (N,), boxes.id is (N,)
-                xyxys = boxes.xyxy.tolist()
-                confs = boxes.conf.tolist()
-                clss = boxes.cls.tolist()
-                track_ids = boxes.id.tolist()
-
-                for xyxy, conf, cls_id, track_id in zip(xyxys, confs, clss, track_ids):
-                    cls_name = names.get(int(cls_id), str(int(cls_id)))
-                    
-                    if cls_name not in COCO_CLASS_TO_CATEGORY:
-                        continue
-                        
-                    detections_vehicle += 1
-                    
-                    _x1, _y1, _x2, _y2 = xyxy
-                    # Optional ROI band
-                    anchor_pt = _anchor_xyxy(xyxy, anchor=args.anchor)
-                    if float(args.roi_band) > 0.0:
-                        band_h = float(proc_height) * float(args.roi_band)
-                        half_band = band_h / 2.0
-                        if not ((line_y_px - half_band) <= anchor_pt[1] <= (line_y_px + half_band)):
-                            continue
-
-                    observations.append(
-                        TrackObservation(
-                            track_id=int(track_id),
-                            center_xy=anchor_pt,
-                            coco_class_name=cls_name,
-                            is_confirmed=True, # ByteTrack native results are generally confirmed tracks
-                        )
-                    )
-
-                    if writer is not None or args.show:
-                        # Draw bbox + label
-                        x1, y1, x2, y2 = [int(v) for v in xyxy]
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 200, 0), 2)
-                        label = f"{cls_name} #{int(track_id)}"
-                        cv2.putText(
-                            frame,
-                            label,
-                            (x1, max(20, y1 - 7)),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.6,
-                            (0, 0, 0),
-                            3,
-                        )
-                        cv2.putText(
-                            frame,
-                            label,
-                            (x1, max(20, y1 - 7)),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.6,
-                            (255, 255, 255),
-                            1,
-                        )
-
-        counter.update(observations)
-
-        if writer is not None or args.show:
-            # Draw line
-            cv2.line(
-                frame,
-                (0, int(line_y_px)),
-                (proc_width, int(line_y_px)),
-                (0, 255, 255),
-                2,
+        codec = None
+        if not skip_video:
+            # H.264 via PyAV (NVENC/QSV/VideoToolbox/libx264) when available, else OpenCV mp4v.
+            # Only processed frames are written, so the output rate is divided by the stride.
+            writer, codec = open_video_writer(
+                out_video_path, fps / stride, (width, height), ENCODER_CHOICES[encoder]
             )
 
-            cj = counter.counts.to_jsonable()
-            text1 = f"total={cj['total']} in={cj['in']['total']} out={cj['out']['total']}"
-            text2 = (
-                f"car={cj['by_category']['car']} bike={cj['by_category']['bike']} bus={cj['by_category']['bus']} "
-                f"truck={cj['by_category']['truck']}"
+        run_info = {
+            "video": str(video_path),
+            "model": model,
+            "line_y": line_y,
+            "anchor": anchor,
+            "tracking": {
+                "tracker": "bytetrack",
+                "conf": float(conf),
+                "frame_stride": stride,
+                "scale": float(scale),
+                "imgsz": [proc_height, proc_width],
+                "roi_band": float(roi_band),
+                "skip_video": bool(skip_video),
+                "decoder": cap.backend,
+                "resize": "cuda" if use_cuda_resize else "cpu",
+                "encoder": codec,
+                "batch_size": batch_size,
+                "device": device,
+                "half": bool(half),
+            },
+        }
+
+        # counts.json is only refreshed every few hundred frames; the ledger has every crossing.
+        ledger = _EventLedger(out_path.with_name(EVENTS_FILENAME))
+
+        counter = LineCrossingCounter(
+            Line(y_px=line_y_px),
+            invert_directions=invert_directions,
+            line_margin_px=line_margin_px,
+            on_count=ledger.log,
+        )
+
+        frame_idx = 0
+        frames_total = 0
+        frames_used = 0
+        detections_total = 0
+        detections_vehicle = 0
+        draw = writer is not None or show
+        hud = _Hud(_LineOverlay(width, height, line_y_px)) if draw else None
+        last_snapshot_frame = 0
+
+        reader_thread = threading.Thread(
+            target=_read_frames, args=(cap, read_q, stop, stride, prepare, read_errors), daemon=True
+        )
+        reader_thread.start()
+
+        # With --skip-video there is no writer, no writer thread and nothing is drawn.
+        if writer is not None:
+            writer_thread = threading.Thread(
+                target=_write_frames, args=(writer, write_q, write_errors), daemon=True
             )
-            cv2.putText(frame, text1, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 3)
-            cv2.putText(frame, text1, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 1)
-            cv2.putText(frame, text2, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 3)
-            cv2.putText(frame, text2, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 1)
-
-            if writer is not None:
-                writer.write(frame)
-
-            if args.show:
-                cv2.imshow("vehicle-count", frame)
-                if cv2.waitKey(1) & 0xFF == ord("q"):
-                    break
-
-    cap.release()
-    if writer is not None:
-        writer.release()
-    if args.show:
-        cv2.destroyAllWindows()
-
-    out_path = Path(args.save_json)
-    _ensure_parent_dir(out_path)
+            writer_thread.start()
+
+        # The reader only hands over every `stride`-th frame; each one stands in for `stride`
+        # source frames. Inference runs once `batch_size` frames are pending, or at EOF.
+        pending: List[Tuple[int, object, object]] = []
+        done = False
+        while not done:
+            item = read_q.get()
+            at_eof = item is _EOF or bool(max_frames and frame_idx + stride > max_frames)
+            if not at_eof:
+                frame_idx += stride
+                frames_total += stride
+                frame, model_input = item
+                pending.append((frame_idx, frame, model_input))
+                if len(pending) < batch_size:
+                    continue
+            done = at_eof
+
+            batch = [model_input for _idx, _frame, model_input in pending]
+            results = []
+            if batch:
+                # Use model.track instead of predict for native tracking. Frames of a batch
+                # are tracked in order, and persist=True keeps IDs stable across batches.
+                results = yolo.track(batch, tracker=tracker_config, **track_kwargs)
+            results_iter = iter(results or [])
+
+            for source_idx, frame, _model_input in pending:
+                frames_used += 1
+                r = next(results_iter, None)
+                if r is None:
+                    if writer is not None:
+                        write_q.put(frame)
+                    continue
+
+                observations, drawn, n_raw, n_vehicle = _extract_observations(
+                    r,
+                    anchor=anchor,
+                    roi_band=roi_band,
+                    frame_height=height,
+                    line_y_px=line_y_px,
+                    category_table=category_table,
+                    inv_scale=inv_scale,
+                    y_offset=float(crop_y0),
+                    collect_drawn=draw,
+                )
+                detections_total += n_raw
+                detections_vehicle += n_vehicle
+
+                ledger.frame = source_idx
+                counter.update_batch(*observations)
+
+                if draw:
+                    _draw_detections(frame, drawn)
+                    hud.draw(frame, counter.counts)
+
+                    if writer is not None:
+                        write_q.put(frame)
+
+                    if show:
+                        cv2.imshow("vehicle-count", frame)
+                        if cv2.waitKey(1) & 0xFF == ord("q"):
+                            done = True
+                            break
+
+            pending.clear()
+
+            if not done and frame_idx - last_snapshot_frame >= _SNAPSHOT_EVERY_FRAMES:
+                last_snapshot_frame = frame_idx
+                debug = _debug_stats(frames_total, frames_used, detections_total, detections_vehicle)
+                _write_json_atomic(out_path, _build_payload(run_info, counter, debug, complete=False))
+        completed = True
+    finally:
+        if ledger is not None:
+            ledger.close()
+        stop.set()
+        if reader_thread is not None:
+            reader_thread.join()
+        if writer_thread is not None:
+            write_q.put(_EOF)
+            writer_thread.join()
+        if cap is not None:
+            cap.release()
+        if writer is not None:
+            writer.release()
+            if not completed or read_errors or write_errors:
+                # Don't leave a truncated annotated.mp4 behind for the dashboard to serve.
+                out_video_path.unlink(missing_ok=True)
+        if show:
+            cv2.destroyAllWindows()
+
+    if read_errors:
+        raise RuntimeError(f"Failed to read video: {read_errors[0]}")
+    if write_errors:
+        raise RuntimeError(f"Failed to write annotated video: {write_errors[0]}")
+
+    debug = _debug_stats(frames_total, frames_used, detections_total, detections_vehicle)
+    payload = _build_payload(run_info, counter, debug, complete=True)
+    _write_json_atomic(out_path, payload)
+    return payload
 
-    payload = {
-        "video": str(video_path),
-        "model": args.model,
-        "line_y": args.line_y,
-        "anchor": args.anchor,
-        "tracking": {
-            "tracker": "bytetrack",
-            "conf": float(args.conf),
-            "frame_stride": int(max(1, args.frame_stride)),
-            "scale": float(args.scale),
-            "roi_band": float(args.roi_band),
-            "skip_video": bool(args.skip_video),
-        },
-        "debug": {
-            "frames_total": int(frames_total),
-            "frames_used": int(frames_used),
-            "raw_detections_total": int(detections_total),
-            "vehicle_detections_total": int(detections_vehicle),
-        },
-        "counts": counter.counts.to_jsonable(),
-        "counted_track_ids": sorted(counter.counted_track_ids),
-        "generated_at": datetime.now(timezone.utc).isoformat(),
-    }
 
-    out_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
-    print(json.dumps(payload, indent=2))
+def main() -> int:
+    args = _parse_args()
+    try:
+        payload = run_count(
+            args.video,
+            model=args.model,
+            line_y=args.line_y,
+            invert_directions=args.invert_directions,
+            conf=args.conf,
+            frame_stride=args.frame_stride,
+            scale=args.scale,
+            roi_band=args.roi_band,
+            skip_video=args.skip_video,
+            anchor=args.anchor,
+            save_json=args.save_json,
+            output_video=args.output_video,
+            max_frames=args.max_frames,
+            show=args.show,
+            batch_size=args.batch_size,
+            device=args.device,
+            half=args.half,
+            hwaccel=args.hwaccel,
+            use_trt=args.use_trt,
+            encoder=args.encoder,
+        )
+    except (ValueError, RuntimeError) as e:
+        raise SystemExit(str(e))
+    print(orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode("utf-8"))
     return 0
 
 
@@ -0,0 +1,134 @@
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+
+from backend.scripts.count_video import (  # noqa: E402
+    InvalidOptionsError,
+    _EventLedger,
+    _align_to_stride,
+    _extract_observations,
+    _inference_input,
+    _inference_size,
+    _track_kwargs,
+    _write_json_atomic,
+    run_count,
+)
+from backend.vehicle_counting.line_counter import Line, LineCrossingCounter  # noqa: E402
+
+
+class _HostTensor:
+    """Stands in for a torch tensor that is already on the host."""
+
+    def __init__(self, array: np.ndarray):
+        self._array = array
+
+    def cpu(self) -> "_HostTensor":
+        return self
+
+    def numpy(self) -> np.ndarray:
+        return self._array
+
+
+def _tracked_result(rows, names):
+    # Tracked boxes.data columns: x1, y1, x2, y2, track id, conf, cls
+    data = np.array(rows, dtype=np.float32)
+    return SimpleNamespace(names=names, boxes=SimpleNamespace(data=_HostTensor(data), id=data[:, 4]))
+
+
+def test_extract_observations_maps_back_to_full_resolution() -> None:
+    # 1280x1000 frame, ROI crop rows 400..1000 resized to 640x320 -> x * 2.0, y * 1.875 + 400
+    names = {0: "person", 2: "car"}
+    category_table = np.array([-1, -1, 0], dtype=np.int8)
+    r = _tracked_result(
+        [
+            [100, 100, 200, 160, 7, 0.9, 2],  # car, bottom anchor (300, 700): inside the band
+            [0, 0, 50, 20, 9, 0.9, 2],  # car, anchor y 437.5: outside the band
+            [300, 100, 320, 160, 3, 0.9, 0],  # person: not a vehicle
+        ],
+        names,
+    )
+
+    (track_ids, ys, category_ids), drawn, n_raw, n_vehicle = _extract_observations(
+        r,
+        anchor="bottom",
+        roi_band=0.1,
+        frame_height=1000,
+        line_y_px=650.0,
+        category_table=category_table,
+        inv_scale=(2.0, 1.875),
+        y_offset=400.0,
+    )
+
+    assert track_ids.tolist() == [7]
+    assert ys.tolist() == pytest.approx([700.0])
+    assert category_ids.tolist() == [0]
+    assert (n_raw, n_vehicle) == (3, 2)
+    assert len(drawn) == 1
+    assert drawn[0][0] == pytest.approx([200.0, 587.5, 400.0, 700.0])
+    assert drawn[0][1] == "car #7"
+
+
+def test_inference_size_caps_long_side_and_aligns_to_stride() -> None:
+    assert _align_to_stride(10) == 32
+    assert _inference_size(1920, 1080, 1.0) == (640, 352)
+    assert _inference_size(1920, 1080, 0.25) == (480, 256)
+
+    frame = np.zeros((100, 64, 3), dtype=np.uint8)
+    assert _inference_input(frame, crop_y0=20, crop_y1=84, proc_size=(32, 32)).shape == (32, 32, 3)
+    # Already the right size after the crop: no resize
+    assert _inference_input(frame, crop_y0=20, crop_y1=84, proc_size=(64, 64)).shape == (64, 64, 3)
+
+
+@pytest.mark.parametrize("model", ["yolov8n-fp16-b8.engine", "yolov8n.onnx"])
+def test_track_kwargs_leave_imgsz_to_exported_models(model: str) -> None:
+    kwargs = _track_kwargs(model, conf=0.25, classes=[2], imgsz=(352, 640), device="cpu", half=False)
+
+    assert "imgsz" not in kwargs
+    assert None not in kwargs.values()
+
+
+def test_track_kwargs_pass_imgsz_to_pytorch_checkpoints() -> None:
+    kwargs = _track_kwargs("yolov8n.pt", conf=0.25, classes=None, imgsz=(352, 640), device="cpu", half=False)
+
+    assert kwargs["imgsz"] == (352, 640)
+    assert kwargs["persist"] is True
+
+
+@pytest.mark.parametrize("options", [{"scale": 2.0}, {"encoder": "divx"}, {"hwaccel": "nope"}])
+def test_run_count_rejects_invalid_options_before_loading(tmp_path, options) -> None:
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"")
+
+    with pytest.raises(InvalidOptionsError):
+        run_count(video, save_json=tmp_path / "counts.json", output_video=tmp_path / "out.mp4", **options)
+
+
+def test_event_ledger_stamps_crossings_with_the_current_frame(tmp_path) -> None:
+    path = tmp_path / "events.ndjson"
+    ledger = _EventLedger(path)
+    counter = LineCrossingCounter(Line(y_px=10), line_margin_px=0.0, on_count=ledger.log)
+
+    for frame, (ys, category_ids) in enumerate([([5, 15], [0, 1]), ([15, 5], [0, 1]), ([20, 0], [0, 1])]):
+        ledger.frame = frame * 2
+        counter.update_batch(np.array([1, 2]), np.array(ys, dtype=np.float64), np.array(category_ids))
+    ledger.close()
+
+    events = [orjson.loads(line) for line in path.read_bytes().splitlines()]
+    assert events == [
+        {"track_id": 1, "category": "car", "direction": "in", "t": 2},
+        {"track_id": 2, "category": "bike", "direction": "out", "t": 2},
+    ]
+
+
+def test_write_json_atomic_replaces_without_leaving_tmp_files(tmp_path) -> None:
+    path = tmp_path / "counts.json"
+    _write_json_atomic(path, {"total": 1})
+    _write_json_atomic(path, {"total": 2})
+
+    assert orjson.loads(path.read_bytes()) == {"total": 2}
+    assert [p.name for p in tmp_path.iterdir()] == ["counts.json"]
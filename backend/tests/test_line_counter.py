@@ -1,4 +1,16 @@
-from backend.vehicle_counting.line_counter import Line, LineCrossingCounter, TrackObservation
+import numpy as np
+
+from backend.vehicle_counting import line_counter
+from backend.vehicle_counting.line_counter import (
+    VEHICLE_CATEGORIES,
+    Counts,
+    CrossingDirection,
+    Line,
+    LineCrossingCounter,
+    TrackObservation,
+    VehicleCategory,
+    categorize_ids,
+)
 
 
 def test_counts_only_on_crossing_once() -> None:
@@ -41,3 +53,66 @@ def test_ignores_non_vehicle_classes() -> None:
     c.update([TrackObservation(track_id=9, center_xy=(0, 20), coco_class_name="person")])
 
     assert c.counts.total == 0
+
+
+def test_on_count_called_once_per_counted_track() -> None:
+    events = []
+    c = LineCrossingCounter(Line(y_px=10), on_count=lambda *e: events.append(e))
+
+    c.update([TrackObservation(track_id=4, center_xy=(0, 20), coco_class_name="truck")])
+    c.update([TrackObservation(track_id=4, center_xy=(0, 0), coco_class_name="truck")])
+    c.update([TrackObservation(track_id=4, center_xy=(0, 20), coco_class_name="truck")])
+
+    assert events == [(4, VehicleCategory.truck, CrossingDirection.out_lane)]
+
+
+def test_categorize_ids_maps_coco_ids_and_rejects_others() -> None:
+    # person, bicycle, car, motorcycle, bus, truck, out of range
+    cat_ids = categorize_ids(np.array([0, 1, 2, 3, 5, 7, 99]))
+    assert cat_ids[0] == -1 and cat_ids[-1] == -1
+    assert [VEHICLE_CATEGORIES[i] for i in cat_ids[1:-1]] == [
+        VehicleCategory.bike,
+        VehicleCategory.car,
+        VehicleCategory.bike,
+        VehicleCategory.bus,
+        VehicleCategory.truck,
+    ]
+
+
+def test_update_batch_counts_and_grows_past_initial_capacity() -> None:
+    c = LineCrossingCounter(Line(y_px=10))
+    big_id = LineCrossingCounter.INITIAL_CAPACITY * 3
+
+    # car and truck above the line, then both below; the person (-1) is never counted
+    c.update_batch(np.array([1, big_id]), np.array([0.0, 0.0]), np.array([0, 3]))
+    c.update_batch(np.array([1, big_id, 7]), np.array([20.0, 20.0, 20.0]), np.array([0, 3, -1]))
+
+    j = c.counts.to_jsonable()
+    assert j["in"]["total"] == 2
+    assert j["by_category"]["car"] == 1 and j["by_category"]["truck"] == 1
+    assert c.counted_track_ids == [1, big_id]
+
+
+def test_loop_and_numpy_crossing_kernels_agree() -> None:
+    results = []
+    for kernel in (line_counter._find_crossings_numpy, line_counter._find_crossings_loop):
+        n = 16
+        state, counted = np.zeros(n, dtype=np.int8), np.zeros(n, dtype=bool)
+        votes = np.zeros((n, len(VEHICLE_CATEGORIES)), dtype=np.int32)
+        ids = np.array([1, 2, 3, 4])
+        cats = np.array([0, 2, -1, 3])
+        kernel(ids, np.array([0.0, 20.0, 0.0, 10.0]), cats, 10.0, 1.0, state, counted, votes)
+        out = kernel(ids, np.array([20.0, 0.0, 20.0, 20.0]), cats, 10.0, 1.0, state, counted, votes)
+        results.append(([a.tolist() for a in out], state.tolist(), counted.tolist(), votes.tolist()))
+
+    assert results[0] == results[1]
+    # car moved down, bus moved up; the person has no votes and the truck started in the margin
+    assert results[0][0] == [[1, 2], [0, 2], [True, False]]
+
+
+def test_counts_compare_by_value() -> None:
+    a, b = Counts(), Counts()
+    assert a == b
+
+    a.add(np.array([0]), np.array([True]))
+    assert a != b
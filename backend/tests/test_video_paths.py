@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from backend.app.video_paths import inspect_video_path, strip_quotes
+
+
+def test_existing_file(tmp_path) -> None:
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"")
+
+    info = inspect_video_path(strip_quotes(f' "{video}" '))
+
+    assert info == {"exists": True, "is_file": True, "resolved_path": os.path.realpath(video)}
+
+
+def test_missing_file(tmp_path) -> None:
+    info = inspect_video_path(str(tmp_path / "missing.mp4"))
+
+    assert info["exists"] is False
+    assert "error" not in info
+
+
+def test_directory_is_not_a_file(tmp_path) -> None:
+    info = inspect_video_path(str(tmp_path))
+
+    assert info["exists"] is True
+    assert info["is_file"] is False
+
+
+def test_path_through_a_file_is_missing(tmp_path) -> None:
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"")
+
+    info = inspect_video_path(str(video / "nested.mp4"))
+
+    assert info["exists"] is False
+    assert "error" not in info
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="needs symlink support")
+def test_broken_symlink_is_missing(tmp_path) -> None:
+    link = tmp_path / "clip.mp4"
+    link.symlink_to(tmp_path / "gone.mp4")
+
+    info = inspect_video_path(str(link))
+
+    assert info["exists"] is False
+    assert info["resolved_path"] == os.path.realpath(tmp_path / "gone.mp4")
+
+
+def test_embedded_nul_is_an_error(tmp_path) -> None:
+    info = inspect_video_path(f"{tmp_path}/clip\0.mp4")
+
+    assert info["exists"] is False
+    assert info["resolved_path"] is None
+    assert "error" in info
@@ -2,7 +2,14 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Dict, Iterable, Optional, Set, Tuple
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the NumPy path below is used without it
+    njit = None
 
 
 class VehicleCategory(str, Enum):
@@ -25,14 +32,57 @@ COCO_CLASS_TO_CATEGORY: Dict[str, VehicleCategory] = {
     "bicycle": VehicleCategory.bike,
 }
 
+# Category id (row/column index used by the array APIs) -> category.
+VEHICLE_CATEGORIES: Tuple[VehicleCategory, ...] = tuple(VehicleCategory)
+
+# COCO class ids of the names in COCO_CLASS_TO_CATEGORY.
+COCO_CLASS_IDS: Dict[str, int] = {
+    "bicycle": 1,
+    "car": 2,
+    "motorcycle": 3,
+    "bus": 5,
+    "truck": 7,
+}
+
+# bicycle, car, motorcycle, bus, truck
+VEHICLE_COCO_IDS: Tuple[int, ...] = tuple(sorted(COCO_CLASS_IDS.values()))
+
+
+def category_ids_for_names(names: Mapping[int, str]) -> np.ndarray:
+    """int8 table indexed by model class id: category id, or -1 for non-vehicle classes."""
+    table = np.full(max(names, default=-1) + 1, -1, dtype=np.int8)
+    for cls_id, name in names.items():
+        category = COCO_CLASS_TO_CATEGORY.get(name)
+        if category is not None:
+            table[cls_id] = VEHICLE_CATEGORIES.index(category)
+    return table
+
+
+# Same table for the 80 COCO classes.
+CATEGORY_BY_COCO_ID = np.full(80, -1, dtype=np.int8)
+for _name, _cls_id in COCO_CLASS_IDS.items():
+    CATEGORY_BY_COCO_ID[_cls_id] = VEHICLE_CATEGORIES.index(COCO_CLASS_TO_CATEGORY[_name])
+
+
+def categorize_ids(cls_ids: np.ndarray, table: np.ndarray = CATEGORY_BY_COCO_ID) -> np.ndarray:
+    """Map class ids to category ids (index into VEHICLE_CATEGORIES); -1 for non-vehicles.
 
-@dataclass
+    `table` defaults to the COCO ids; pass `category_ids_for_names(model.names)` for other models.
+    """
+    cls_ids = np.asarray(cls_ids, dtype=np.intp)
+    out = np.full(cls_ids.shape, -1, dtype=np.int8)
+    valid = (cls_ids >= 0) & (cls_ids < table.size)
+    out[valid] = table[cls_ids[valid]]
+    return out
+
+
+@dataclass(slots=True)
 class Line:
     # Horizontal line only for now: y = y_px
     y_px: float
 
 
-@dataclass
+@dataclass(slots=True)
 class TrackObservation:
     track_id: int
     center_xy: Tuple[float, float]
@@ -40,39 +90,58 @@ class TrackObservation:
     # If False, we record positions/votes but do not count crossings yet.
     # This helps avoid early false counts from unstable track IDs.
     is_confirmed: bool = True
+    # Pre-resolved category (e.g. from `categorize_ids`); skips the name lookup when set.
+    category: Optional[VehicleCategory] = None
 
 
-@dataclass
+# Rows of Counts.matrix.
+_TOTAL_ROW, _IN_ROW, _OUT_ROW = 0, 1, 2
+
+
+@dataclass(slots=True, eq=False)
 class Counts:
-    total: int = 0
-    by_category: Dict[VehicleCategory, int] = field(
-        default_factory=lambda: {
-            VehicleCategory.car: 0,
-            VehicleCategory.bike: 0,
-            VehicleCategory.bus: 0,
-            VehicleCategory.truck: 0,
-        }
-    )
-
-    # Directional totals (interpreting the line as separating "in" vs "out")
-    total_in: int = 0
-    total_out: int = 0
-    by_category_in: Dict[VehicleCategory, int] = field(
-        default_factory=lambda: {
-            VehicleCategory.car: 0,
-            VehicleCategory.bike: 0,
-            VehicleCategory.bus: 0,
-            VehicleCategory.truck: 0,
-        }
-    )
-    by_category_out: Dict[VehicleCategory, int] = field(
-        default_factory=lambda: {
-            VehicleCategory.car: 0,
-            VehicleCategory.bike: 0,
-            VehicleCategory.bus: 0,
-            VehicleCategory.truck: 0,
-        }
-    )
+    # [total, in, out] x VEHICLE_CATEGORIES; the totals and per-category dicts are views on it.
+    # Directional rows interpret the line as separating "in" vs "out".
+    matrix: np.ndarray = field(default_factory=lambda: np.zeros((3, len(VEHICLE_CATEGORIES)), dtype=np.int64))
+
+    # The generated __eq__ would compare the arrays element-wise and fail on the result.
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Counts):
+            return NotImplemented
+        return bool(np.array_equal(self.matrix, other.matrix))
+
+    @property
+    def total(self) -> int:
+        return int(self.matrix[_TOTAL_ROW].sum())
+
+    @property
+    def total_in(self) -> int:
+        return int(self.matrix[_IN_ROW].sum())
+
+    @property
+    def total_out(self) -> int:
+        return int(self.matrix[_OUT_ROW].sum())
+
+    def _by_category(self, row: int) -> Dict[VehicleCategory, int]:
+        return dict(zip(VEHICLE_CATEGORIES, self.matrix[row].tolist()))
+
+    @property
+    def by_category(self) -> Dict[VehicleCategory, int]:
+        return self._by_category(_TOTAL_ROW)
+
+    @property
+    def by_category_in(self) -> Dict[VehicleCategory, int]:
+        return self._by_category(_IN_ROW)
+
+    @property
+    def by_category_out(self) -> Dict[VehicleCategory, int]:
+        return self._by_category(_OUT_ROW)
+
+    def add(self, category_ids: np.ndarray, moved_in: np.ndarray) -> None:
+        """Count one crossing per entry: category id (index into VEHICLE_CATEGORIES) and direction."""
+        np.add.at(self.matrix[_TOTAL_ROW], category_ids, 1)
+        np.add.at(self.matrix[_IN_ROW], category_ids[moved_in], 1)
+        np.add.at(self.matrix[_OUT_ROW], category_ids[~moved_in], 1)
 
     def to_jsonable(self) -> dict:
         return {
@@ -89,114 +158,195 @@ class Counts:
         }
 
 
+# Per-track state codes in LineCrossingCounter._state.
+_UNKNOWN, _ABOVE, _BELOW = 0, 1, 2
+
+_CATEGORY_INDEX: Dict[VehicleCategory, int] = {c: i for i, c in enumerate(VEHICLE_CATEGORIES)}
+
+
+def _find_crossings_numpy(track_ids, ys, category_ids, line_y, margin, state, counted, votes):
+    """Apply one frame to the per-track arrays and return the newly counted tracks.
+
+    Updates `votes`, `state` and `counted` in place. Returns (track ids, category ids,
+    moved-down flags) for the tracks that crossed the line for the first time in this frame.
+    """
+    is_vehicle = category_ids >= 0
+    np.add.at(votes, (track_ids[is_vehicle], category_ids[is_vehicle]), 1)
+
+    current = np.where(ys < line_y - margin, _ABOVE, np.where(ys > line_y + margin, _BELOW, _UNKNOWN))
+
+    # Inside the margin we keep the previous state and wait for the track to emerge.
+    outside = current != _UNKNOWN
+    previous = state[track_ids]
+    state[track_ids[outside]] = current[outside]
+
+    # State changed (Above -> Below OR Below -> Above) for a track not counted yet,
+    # and at least one vehicle vote to pick a category from.
+    crossed = outside & (previous != _UNKNOWN) & (previous != current) & ~counted[track_ids]
+    crossed_ids = track_ids[crossed]
+    track_votes = votes[crossed_ids]
+    has_votes = track_votes.any(axis=1)
+    crossed_ids = crossed_ids[has_votes]
+    counted[crossed_ids] = True
+    return crossed_ids, track_votes[has_votes].argmax(axis=1), previous[crossed][has_votes] == _ABOVE
+
+
+def _find_crossings_loop(track_ids, ys, category_ids, line_y, margin, state, counted, votes):
+    """Same contract as `_find_crossings_numpy`, written as a plain loop for numba to compile."""
+    n = track_ids.shape[0]
+    out_ids = np.empty(n, dtype=np.int64)
+    out_categories = np.empty(n, dtype=np.int64)
+    out_moved_down = np.empty(n, dtype=np.bool_)
+    k = 0
+    for i in range(n):
+        tid = track_ids[i]
+        if category_ids[i] >= 0:
+            votes[tid, category_ids[i]] += 1
+        y = ys[i]
+        if y < line_y - margin:
+            current = _ABOVE
+        elif y > line_y + margin:
+            current = _BELOW
+        else:
+            continue
+        previous = state[tid]
+        state[tid] = current
+        if previous == _UNKNOWN or previous == current or counted[tid]:
+            continue
+        best = 0
+        for c in range(1, votes.shape[1]):
+            if votes[tid, c] > votes[tid, best]:
+                best = c
+        if votes[tid, best] == 0:
+            continue
+        counted[tid] = True
+        out_ids[k] = tid
+        out_categories[k] = best
+        out_moved_down[k] = previous == _ABOVE
+        k += 1
+    return out_ids[:k], out_categories[:k], out_moved_down[:k]
+
+
+# nogil lets the kernel overlap with the decode/encode threads; cache=True keeps the compiled
+# code on disk so only the very first run pays the JIT cost.
+_find_crossings = (
+    njit(nogil=True, cache=True)(_find_crossings_loop) if njit is not None else _find_crossings_numpy
+)
+
+
 class LineCrossingCounter:
     """Counts unique tracked objects when they cross a horizontal virtual line.
 
     - Only counts COCO classes present in COCO_CLASS_TO_CATEGORY.
     - Each track_id is counted at most once (first time it crosses).
-    - Category is chosen as the most frequently observed mapped category for that track.
+    - Category is chosen as the most frequently observed mapped category for that track
+      (ties go to the category listed first in VehicleCategory).
 
     Robustness notes:
     - `line_margin_px` creates a "dead zone" around the line.
     - Vehicles inside the margin are ignored (we maintain their previous state).
     - Crossing is triggered only when a vehicle moves from cleanly ABOVE to cleanly BELOW (or vice-versa).
+
+    Per-track state lives in arrays indexed by track_id (tracker ids are small increasing
+    non-negative ints), grown by doubling as new ids appear.
     """
 
+    INITIAL_CAPACITY = 256
+
     def __init__(
         self,
         line: Line,
         *,
         invert_directions: bool = False,
         line_margin_px: float = 0.0,
+        on_count: Optional[Callable[[int, VehicleCategory, CrossingDirection], None]] = None,
     ):
         self._line = line
         self._invert_directions = invert_directions
         self._margin_px = float(max(0.0, line_margin_px))
-        
-        # Track state: True if ABOVE line, False if BELOW line. None if unknown/in-margin initially.
-        self._is_above_by_track: Dict[int, bool] = {}
-        
-        self._counted_track_ids: Set[int] = set()
-        self._category_votes: Dict[int, Dict[VehicleCategory, int]] = {}
+        # Called once per counted track with (track_id, category, direction).
+        self._on_count = on_count
+
+        n = self.INITIAL_CAPACITY
+        # _UNKNOWN until the track is first seen outside the margin, then _ABOVE / _BELOW.
+        self._state = np.zeros(n, dtype=np.int8)
+        self._counted = np.zeros(n, dtype=bool)
+        # Category votes: one column per VEHICLE_CATEGORIES entry.
+        self._votes = np.zeros((n, len(VEHICLE_CATEGORIES)), dtype=np.int32)
         self.counts = Counts()
 
     @property
-    def counted_track_ids(self) -> Set[int]:
-        return set(self._counted_track_ids)
-
-    def _vote_category(self, track_id: int, coco_class_name: str) -> Optional[VehicleCategory]:
-        category = COCO_CLASS_TO_CATEGORY.get(coco_class_name)
-        if category is None:
-            return None
-        votes = self._category_votes.setdefault(track_id, {})
-        votes[category] = votes.get(category, 0) + 1
-        return category
-
-    def _best_category(self, track_id: int) -> Optional[VehicleCategory]:
-        votes = self._category_votes.get(track_id)
-        if not votes:
-            return None
-        return max(votes.items(), key=lambda kv: kv[1])[0]
-
-    def _get_current_state(self, y: float) -> Optional[bool]:
-        """Returns True if ABOVE, False if BELOW, None if in MARGIN."""
-        line_y = float(self._line.y_px)
-        m = float(self._margin_px)
-        
-        if y < (line_y - m):
-            return True  # Above
-        if y > (line_y + m):
-            return False # Below
-        return None      # In margin
+    def counted_track_ids(self) -> List[int]:
+        """Counted track ids in ascending order (read straight off the counted mask)."""
+        return np.flatnonzero(self._counted).tolist()
+
+    def _ensure_capacity(self, max_track_id: int) -> None:
+        n = self._state.shape[0]
+        if max_track_id < n:
+            return
+        new_n = max(2 * n, max_track_id + 1)
+        grow = new_n - n
+        self._state = np.concatenate((self._state, np.zeros(grow, dtype=self._state.dtype)))
+        self._counted = np.concatenate((self._counted, np.zeros(grow, dtype=bool)))
+        self._votes = np.concatenate(
+            (self._votes, np.zeros((grow, self._votes.shape[1]), dtype=self._votes.dtype))
+        )
 
     def update(self, observations: Iterable[TrackObservation]) -> None:
-        for obs in observations:
-            self._vote_category(obs.track_id, obs.coco_class_name)
-
-            y = float(obs.center_xy[1])
-            current_is_above = self._get_current_state(y)
-
-            # If inside margin, do nothing. We wait for it to emerge.
-            if current_is_above is None:
-                continue
-
-            prev_is_above = self._is_above_by_track.get(obs.track_id)
-            
-            # Update state for next time
-            self._is_above_by_track[obs.track_id] = current_is_above
-
-            # If we didn't have a previous state, we can't detect a crossing yet.
-            if prev_is_above is None:
-                continue
-
-            # If state hasn't changed, no crossing.
-            if prev_is_above == current_is_above:
-                continue
-
-            # State changed (Above -> Below OR Below -> Above)
-            if obs.track_id in self._counted_track_ids:
-                continue
-
-            category = self._best_category(obs.track_id)
-            if category is None:
-                continue
-
-            # Count this track
-            self._counted_track_ids.add(obs.track_id)
-            self.counts.total += 1
-            self.counts.by_category[category] += 1
-
-            # Determine direction
-            # If default (not inverted): Top(low y) -> Bottom(high y) is IN.
-            # So Above(True) -> Below(False) is IN.
-            moved_in = (prev_is_above is True) and (current_is_above is False)
-            
-            if self._invert_directions:
-                moved_in = not moved_in
-
-            if moved_in:
-                self.counts.total_in += 1
-                self.counts.by_category_in[category] += 1
-            else:
-                self.counts.total_out += 1
-                self.counts.by_category_out[category] += 1
+        """Process one frame of observations (see `update_batch`)."""
+        observations = list(observations)
+        if not observations:
+            return
+        track_ids = np.fromiter((obs.track_id for obs in observations), dtype=np.int64, count=len(observations))
+        ys = np.fromiter((obs.center_xy[1] for obs in observations), dtype=np.float64, count=len(observations))
+        category_ids = np.fromiter(
+            (
+                _CATEGORY_INDEX.get(
+                    obs.category if obs.category is not None else COCO_CLASS_TO_CATEGORY.get(obs.coco_class_name),
+                    -1,
+                )
+                for obs in observations
+            ),
+            dtype=np.int8,
+            count=len(observations),
+        )
+        self.update_batch(track_ids, ys, category_ids)
+
+    def update_batch(self, track_ids: np.ndarray, ys: np.ndarray, category_ids: np.ndarray) -> None:
+        """Process one frame given as parallel arrays.
+
+        `track_ids` are non-negative and unique within the call, `ys` are anchor y coordinates
+        and `category_ids` index VEHICLE_CATEGORIES (-1 for non-vehicle classes, which update
+        position state but are never counted).
+        """
+        # The numba kernel is compiled for one set of dtypes; keep them fixed.
+        track_ids = np.asarray(track_ids, dtype=np.intp)
+        if track_ids.size == 0:
+            return
+        ys = np.asarray(ys, dtype=np.float64)
+        category_ids = np.asarray(category_ids, dtype=np.intp)
+        self._ensure_capacity(int(track_ids.max()))
+
+        crossed_ids, crossed_categories, moved_down = _find_crossings(
+            track_ids,
+            ys,
+            category_ids,
+            float(self._line.y_px),
+            float(self._margin_px),
+            self._state,
+            self._counted,
+            self._votes,
+        )
+        if crossed_ids.size == 0:
+            return
+
+        # If default (not inverted): Top(low y) -> Bottom(high y) is IN.
+        moved_in = moved_down ^ self._invert_directions
+        self.counts.add(crossed_categories, moved_in)
+
+        if self._on_count is not None:
+            for track_id, category_id, is_in in zip(
+                crossed_ids.tolist(), crossed_categories.tolist(), moved_in.tolist()
+            ):
+                direction = CrossingDirection.in_lane if is_in else CrossingDirection.out_lane
+                self._on_count(track_id, VEHICLE_CATEGORIES[category_id], direction)
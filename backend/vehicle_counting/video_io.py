@@ -0,0 +1,272 @@
+"""Video input/output helpers.
+
+Decoding prefers NVDEC (cv2.cudacodec), then multithreaded PyAV, then cv2.VideoCapture;
+`hwaccel` can force software decode or request FFmpeg CUDA/VAAPI decoding instead.
+Encoding prefers H.264 through PyAV (hardware encoders first) and falls back to OpenCV's
+software mp4v writer when PyAV or a usable encoder is not available.
+"""
+from __future__ import annotations
+
+import os
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+
+try:
+    import av
+except ImportError:  # PyAV is optional
+    av = None
+
+try:
+    from av.codec.hwaccel import HWAccel
+except ImportError:  # PyAV < 14 has no hardware decode support
+    HWAccel = None
+
+HWACCEL_CHOICES: Tuple[str, ...] = ("auto", "none", "cuda", "vaapi")
+
+
+class OpenCVVideoReader:
+    """cv2.VideoCapture (CPU decode) behind the common reader interface."""
+
+    backend = "opencv"
+
+    def __init__(self, path: Path, hw_acceleration: Optional[int] = None):
+        if hw_acceleration is None:
+            self._cap = cv2.VideoCapture(str(path))
+        else:
+            self._cap = cv2.VideoCapture(
+                str(path), cv2.CAP_FFMPEG, [cv2.CAP_PROP_HW_ACCELERATION, hw_acceleration]
+            )
+            self.backend = "opencv-hw"
+        if not self._cap.isOpened():
+            raise RuntimeError(f"Failed to open video: {path}")
+        self.width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
+        self.height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+        self.fps = float(self._cap.get(cv2.CAP_PROP_FPS) or 0.0)
+
+    def grab(self) -> bool:
+        return bool(self._cap.grab())
+
+    def read(self):
+        return self._cap.read()
+
+    def release(self) -> None:
+        self._cap.release()
+
+
+class CudaVideoReader:
+    """NVDEC decode via cv2.cudacodec; frames are downloaded to host memory for YOLO."""
+
+    backend = "cudacodec"
+
+    def __init__(self, path: Path):
+        self._reader = cv2.cudacodec.createVideoReader(str(path))
+        # Older builds only emit BGRA.
+        self._bgra = not hasattr(cv2.cudacodec, "ColorFormat_BGR")
+        if not self._bgra:
+            self._reader.set(cv2.cudacodec.ColorFormat_BGR)
+        fmt = self._reader.format()
+        self.width = int(fmt.width)
+        self.height = int(fmt.height)
+        self.fps = float(getattr(fmt, "fps", 0.0) or 0.0)
+
+    def grab(self) -> bool:
+        return bool(self._reader.grab())
+
+    def read(self):
+        ok, gpu_frame = self._reader.nextFrame()
+        if not ok:
+            return False, None
+        frame = gpu_frame.download()
+        if self._bgra:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+        return True, frame
+
+    def release(self) -> None:
+        self._reader = None
+
+
+class PyAVVideoReader:
+    """Multithreaded software decode via PyAV, or FFmpeg hardware decode when `hwaccel` is set."""
+
+    backend = "pyav"
+
+    def __init__(self, path: Path, hwaccel: Optional[str] = None):
+        if hwaccel:
+            # Frames are copied back to host memory on decode, so read() is unchanged.
+            self._container = av.open(
+                str(path), hwaccel=HWAccel(device_type=hwaccel, allow_software_fallback=False)
+            )
+            self.backend = f"pyav-{hwaccel}"
+        else:
+            self._container = av.open(str(path))
+        try:
+            stream = self._container.streams.video[0]
+            stream.thread_type = "AUTO"
+            stream.codec_context.thread_count = os.cpu_count() or 0
+            self.width = int(stream.codec_context.width or 0)
+            self.height = int(stream.codec_context.height or 0)
+            self.fps = float(stream.average_rate or 0.0)
+            self._frames = self._container.decode(stream)
+        except Exception:
+            self._container.close()
+            raise
+
+    def grab(self) -> bool:
+        # Still decodes, but skips the BGR conversion and copy.
+        return next(self._frames, None) is not None
+
+    def read(self):
+        frame = next(self._frames, None)
+        if frame is None:
+            return False, None
+        return True, frame.to_ndarray(format="bgr24")
+
+    def release(self) -> None:
+        self._container.close()
+
+
+def _cuda_decode_available() -> bool:
+    try:
+        return hasattr(cv2, "cudacodec") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except cv2.error:
+        return False
+
+
+def _rotation_degrees(path: Path) -> int:
+    """Display rotation stored in the container (e.g. phone videos), 0 if none or unknown."""
+    if not hasattr(cv2, "CAP_PROP_ORIENTATION_META"):
+        return 0
+    cap = cv2.VideoCapture(str(path))
+    try:
+        return int(cap.get(cv2.CAP_PROP_ORIENTATION_META) or 0) % 360
+    finally:
+        cap.release()
+
+
+def _reader_candidates(path: Path, hwaccel: str) -> List[Callable[[], object]]:
+    """Reader constructors to try, in order, for a `hwaccel` mode."""
+    candidates: List[Callable[[], object]] = []
+    if _rotation_degrees(path):
+        # Only OpenCV's FFmpeg backend applies the rotation metadata (and reports the rotated
+        # size); PyAV and cudacodec would hand over sideways frames, putting the counting line
+        # and ROI band on the wrong axis.
+        if hwaccel != "none" and hasattr(cv2, "VIDEO_ACCELERATION_ANY"):
+            candidates.append(lambda: OpenCVVideoReader(path, cv2.VIDEO_ACCELERATION_ANY))
+        return candidates
+    if hwaccel in ("auto", "cuda") and _cuda_decode_available():
+        candidates.append(lambda: CudaVideoReader(path))
+    if hwaccel in ("cuda", "vaapi") and av is not None and HWAccel is not None:
+        candidates.append(lambda: PyAVVideoReader(path, hwaccel))
+    if hwaccel == "vaapi" and hasattr(cv2, "VIDEO_ACCELERATION_VAAPI"):
+        candidates.append(lambda: OpenCVVideoReader(path, cv2.VIDEO_ACCELERATION_VAAPI))
+    if av is not None:
+        candidates.append(lambda: PyAVVideoReader(path))
+    if hwaccel != "none" and hasattr(cv2, "VIDEO_ACCELERATION_ANY"):
+        # Uses D3D11/VAAPI/MFX when FFmpeg has them and silently decodes in software otherwise.
+        candidates.append(lambda: OpenCVVideoReader(path, cv2.VIDEO_ACCELERATION_ANY))
+    return candidates
+
+
+def open_video_reader(path: Path, hwaccel: str = "auto"):
+    """Open `path` with the fastest available decoder.
+
+    `hwaccel` is one of HWACCEL_CHOICES: "auto" picks the fastest decoder found, "none"
+    forces software decode, "cuda"/"vaapi" try that hardware path first. Unavailable hardware
+    decoders are skipped, so every mode ends up at cv2.VideoCapture in the worst case.
+    Videos with rotation metadata always use cv2.VideoCapture, which is the only backend here
+    that applies it.
+
+    The reader exposes `width`, `height`, `fps`, `backend`, `grab() -> ok` (advance without
+    returning a frame), `read() -> (ok, frame)` and `release()`.
+    Raises ValueError for an unknown `hwaccel` and RuntimeError if the video cannot be opened at all.
+    """
+    hwaccel = (hwaccel or "auto").strip().lower()
+    if hwaccel not in HWACCEL_CHOICES:
+        raise ValueError(f"hwaccel must be one of {', '.join(HWACCEL_CHOICES)}")
+    for open_reader in _reader_candidates(path, hwaccel):
+        try:
+            return open_reader()
+        except Exception:
+            continue
+    return OpenCVVideoReader(path)
+
+
+# Tried in order; the first encoder that opens on this machine wins.
+H264_ENCODERS: Tuple[str, ...] = ("h264_nvenc", "h264_qsv", "h264_videotoolbox", "libx264")
+
+# User-facing encoder choice -> PyAV codecs to try ("mp4v" goes straight to the OpenCV writer).
+ENCODER_CHOICES: Dict[str, Tuple[str, ...]] = {
+    "auto": H264_ENCODERS,
+    "nvenc": ("h264_nvenc",),
+    "libx264": ("libx264",),
+    "mp4v": (),
+}
+
+# Fast presets (libx264 defaults to "medium"); the annotated video is a preview, not an archive.
+_CODEC_OPTIONS: Dict[str, Dict[str, str]] = {
+    "h264_nvenc": {"preset": "p1", "tune": "ll"},
+    "libx264": {"preset": "veryfast"},
+}
+
+
+class PyAVVideoWriter:
+    """Drop-in replacement for cv2.VideoWriter (write/release) backed by a PyAV stream."""
+
+    def __init__(self, container, stream):
+        self._container = container
+        self._stream = stream
+        self.codec_name: str = stream.codec_context.name
+
+    @classmethod
+    def open(cls, path: Path, fps: float, size: Tuple[int, int], codec: str) -> "PyAVVideoWriter":
+        container = av.open(str(path), mode="w")
+        try:
+            stream = container.add_stream(codec, rate=Fraction(fps).limit_denominator(1001))
+            stream.width, stream.height = size
+            stream.pix_fmt = "yuv420p"
+            stream.options = dict(_CODEC_OPTIONS.get(codec, {}))
+            # Open eagerly so a missing GPU/driver fails here instead of on the first frame.
+            stream.codec_context.open()
+        except Exception:
+            container.close()
+            raise
+        return cls(container, stream)
+
+    def write(self, frame) -> None:
+        av_frame = av.VideoFrame.from_ndarray(frame, format="bgr24")
+        self._container.mux(self._stream.encode(av_frame))
+
+    def release(self) -> None:
+        # Flush buffered packets before closing the container.
+        self._container.mux(self._stream.encode(None))
+        self._container.close()
+
+
+def open_video_writer(
+    path: Path,
+    fps: float,
+    size: Tuple[int, int],
+    encoders: Sequence[str] = H264_ENCODERS,
+) -> Tuple[object, str]:
+    """Open the best available writer for BGR frames of `size` (width, height).
+
+    Returns (writer, codec name); the writer exposes `write(frame)` and `release()`.
+    Raises RuntimeError if not even the OpenCV fallback can be opened.
+    """
+    width, height = size
+    # yuv420p needs even dimensions.
+    if av is not None and width % 2 == 0 and height % 2 == 0:
+        for codec in encoders:
+            try:
+                writer = PyAVVideoWriter.open(path, fps, size, codec)
+                return writer, writer.codec_name
+            except Exception:
+                continue
+
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"Failed to open VideoWriter for: {path}")
+    return writer, "mp4v"